@@ -4,10 +4,15 @@ __source__ = 'https://github.com/xHasKx/timelog'
 
 import re
 import sys
-from mmap import mmap
+from bisect import bisect_left
+from itertools import accumulate
+from struct import Struct
+import mmap as mmap_module
+from mmap import mmap, PAGESIZE
 from shlex import quote, join
-from os import execvp, SEEK_SET
-from argparse import ArgumentParser, Namespace, RawDescriptionHelpFormatter, ArgumentDefaultsHelpFormatter
+from os import execvp, replace, sendfile, access, W_OK
+from os.path import dirname
+from argparse import ArgumentParser, Namespace, RawDescriptionHelpFormatter, ArgumentDefaultsHelpFormatter, BooleanOptionalAction
 
 
 # log line examples:
@@ -21,8 +26,38 @@ TIME_LEN = 23
 CHUNKSIZE = 20 * 4096
 'Default chunk size to do a linear search. Assume that several log lines with different time will fit in the memory block of that size'
 
-FULL_DATE_TIME_RE = re.compile(br'^\d{4}/\d{2}/\d{2} \d{2}:\d{2}:\d{2}:\d{3}$')
-'Regexp matching proper full time bytes like b"2023/04/12 16:34:42:099"'
+TIME_PATTERN = b'0000/00/00 00:00:00:000'
+'Shape of the time bytes, zeros are placeholders for digits, other bytes are exact separators'
+
+TIME_DIGITS_TO_ZERO = bytes.maketrans(b'0123456789', b'0' * 10)
+'Translation table mapping every digit to b"0" so the time bytes can be compared with TIME_PATTERN as is'
+
+LINE_BEGIN_LEFT_WINDOWS = (1024, 8192, sys.maxsize)
+'Growing sizes of the window to search for the line begin to the left, the last one is unlimited'
+
+TIME_OFFSETS_SCAN_SIZE = 4096
+'Size of the file head to learn offsets of the time in lines'
+
+TIME_OFFSETS_MAX = 3
+'Max number of the most frequent time offsets in lines to check before looking for the time separator'
+
+INDEX_SUFFIX = '.tlidx'
+'Suffix of the sparse index file name, the index file is created next to the log file'
+
+INDEX_STEP = 1024 * 1024
+'Distance between the indexed lines in the log file'
+
+INDEX_MAGIC = b'TLIDX\x00\x00\x01'
+'First bytes of the index file, with the index format version'
+
+INDEX_HEADER = Struct('<8sQQ')
+'Index file header: INDEX_MAGIC, INDEX_STEP and size of the indexed part of the log file'
+
+INDEX_RECORD = Struct('<Q23s')
+'Index file record: position of the indexed line first char and its time bytes'
+
+SENDFILE_CHUNKSIZE = 8 * 1024 * 1024
+'Max size of data to copy to stdout with one sendfile() call'
 
 SHORT_DATE_TIME_HMS_RE = re.compile(r'^\d{4}/\d{2}/\d{2} \d{2}:\d{2}:\d{2}$')
 'Regexp matching proper date and short time string in `YYYY/mm/dd HH:MM:SS` format'
@@ -42,6 +77,16 @@ TIME_HMS_RE = re.compile(r'^\d{2}:\d{2}:\d{2}$')
 TIME_HM_RE = re.compile(r'^\d{2}:\d{2}$')
 'Regexp matching proper short time string in HH:MM format'
 
+PARTIAL_TIME_FORMATS = {
+    19: (SHORT_DATE_TIME_HMS_RE, True, ':000'),
+    16: (SHORT_DATE_TIME_HM_RE, True, ':00:000'),
+    10: (DATE_RE, True, ' 00:00:00:000'),
+    12: (TIME_RE, False, ''),
+    8: (TIME_HMS_RE, False, ':000'),
+    5: (TIME_HM_RE, False, ':00:000'),
+}
+'Partial time string formats by their length: (regexp, has date, suffix to make the full time)'
+
 class TextFormatter(ArgumentDefaultsHelpFormatter, RawDescriptionHelpFormatter):
     '''
     ArgumentParser help, epilog and args defaults formatter
@@ -55,7 +100,7 @@ def create_argparser() -> ArgumentParser:
         formatter_class=TextFormatter,
         description= \
             'Perform a binary search for the specified time in a big text log file.\n'
-            'Print found log lines to stdout by executing `dd` with proper args,\n'
+            'Print found log lines to stdout with sendfile() or `dd` with proper args,\n'
             'or view it with `less` with proper position on found time.',
         epilog= \
             'Examples of the resulting commands:\n'
@@ -80,69 +125,172 @@ def create_argparser() -> ArgumentParser:
     parser.add_argument('-d', '--debug',        help='Debug binary search stages to stderr', action='store_true')
     parser.add_argument('-a', '--arg',          help='Add an extra argument to the resulting command line', action='append')
     parser.add_argument('-n', '--noexec',       help='Do not execute resulting command, just print it to stdout', action='store_true')
+    parser.add_argument('-p', '--prefetch',     help='Speculatively prefetch both possible next binary search probes, '
+                                                        'may speed up search in a not cached file on SSD', action='store_true')
+    parser.add_argument('-s', '--sendfile',     help='Print found log lines with sendfile() instead of executing `dd`. '
+                                                        'Ignored with --noexec and --arg options, which need `dd` command',
+                                                        action=BooleanOptionalAction, default=sys.platform.startswith('linux'))
+    parser.add_argument('-i', '--index',        help='Narrow the search with a sparse index of line times stored in `<filename>.tlidx` file. '
+                                                        'The index is created on the first use and updated when the log file grows, '
+                                                        'the search runs without it if the index file can not be saved', action='store_true')
     parser.add_argument('-c', '--chunksize',    help='Max chunk size for linear search in file', default=CHUNKSIZE, type=int)
     return parser
 
+def pack_time(data: bytes) -> int:
+    '''
+    Returns time bytes packed into an int, packed times of the same length compare the same way as their bytes
+    '''
+    return int.from_bytes(data, 'big')
+
+def unpack_time(value: int) -> bytes:
+    '''
+    Returns time bytes from the packed time, None is returned as is
+    '''
+    if value is None:
+        return None
+    return value.to_bytes(TIME_LEN, 'big')
+
+def pack_valid_time(data: bytes, _from_bytes=int.from_bytes, _table=TIME_DIGITS_TO_ZERO, _pattern=TIME_PATTERN) -> int:
+    '''
+    Returns packed time like pack_time() if given bytes is a valid time string in form b"2023/04/12 16:34:42:099", otherwise -1.
+    Underscored args are globals bound at definition time to make them fast locals in this hot function.
+    '''
+    # one C-level pass: digits collapse to b"0", so only the exact time shape (and length) equals the pattern
+    if data.translate(_table) != _pattern:
+        return -1
+    return _from_bytes(data, 'big')
+
 def is_valid_time(data: bytes) -> bool:
     '''
     Returns True if given bytes is a valid time string in form b"2023/04/12 16:34:42:099"
     '''
-    if len(data) != TIME_LEN:
-        return False
-    if not FULL_DATE_TIME_RE.match(data):
-        return False
-    return True
+    return data.translate(TIME_DIGITS_TO_ZERO) == TIME_PATTERN
 
-def mem_extract_time(mem: mmap, end: int) -> bytes:
+def mem_find_time(mem: mmap, start: int, end: int, _pack_valid_time=pack_valid_time, _time_len=TIME_LEN) -> tuple[int, int]:
     '''
-    Returns a bytes with time from the current mem position, up to specified end position.
-    Expecting mem position is on the first char of line.
-    Returns None if time cannot be found
+    Returns a tuple (<time_begin>, <time>) with position and packed value of the first valid time in mem between start and end positions.
+    Returns (-1, None) if time cannot be found.
     '''
-    start = mem.tell()
-    while mem.tell() < end:
-        time_begin = mem.find(b': ', start, end)
+    find = mem.find
+    while True:
+        # mmap.find is backed by the same fast search as bytes.find
+        time_begin = find(b': ', start, end)
         if time_begin == -1:
-            return None
+            return (-1, None)
         time_begin += 2
-        mem.seek(time_begin, SEEK_SET)
-        data = mem.read(TIME_LEN)
-        if is_valid_time(data):
-            return data
-        start = mem.tell()
-    return None
+        value = _pack_valid_time(mem[time_begin:time_begin + _time_len])
+        if value != -1:
+            return (time_begin, value)
+        # the next separator may be inside of the rejected data, e.g. in the next short line
+        start = time_begin
 
-def mem_skip_line_begin_right(mem: mmap, end: int) -> int:
+def mem_extract_time(mem: mmap, pos: int, end: int, find_time=mem_find_time) -> tuple[int, int]:
+    '''
+    Returns a tuple (<time_end>, <time>) with packed value of the first time found in mem from pos up to end position,
+    where <time_end> is the position right after the time.
+    Expecting pos is the first char of line.
+    Returns (-1, None) if time cannot be found
+    '''
+    time_begin, value = find_time(mem, pos, end)
+    if time_begin == -1:
+        return (-1, None)
+    return (time_begin + TIME_LEN, value)
+
+def mem_line_begins(mem: mmap, start: int, end: int) -> list[int]:
+    '''
+    Returns positions of the first chars of all lines in mem from start up to end position, start is always the first one
+    '''
+    # split and sum the line lengths in C, instead of looking for each line end in python
+    line_lengths = map((1).__add__, map(len, mem[start:end].split(b'\n')))
+    line_begins = list(accumulate(line_lengths, initial=start))
+    # the last one is after the end
+    line_begins.pop()
+    return line_begins
+
+def mem_line_begin_right(mem: mmap, pos: int, end: int) -> int:
     '''
-    Skip mem position to the first char of the next line.
-    Returns position of the next line first char, or -1 if it can't be found.
+    Returns position of the first char of the line next to the one containing pos, or -1 if it can't be found before end.
     '''
-    start = mem.tell()
-    line_end = mem.find(b'\n', start, end)
+    line_end = mem.find(b'\n', pos, end)
     if line_end == -1:
         return -1
     line_begin = line_end + 1
     if line_begin >= end:
         return -1
-    mem.seek(line_begin, SEEK_SET)
     return line_begin
 
-def mem_skip_line_begin_left(mem: mmap, start: int) -> int:
+def mem_line_begin_left(mem: mmap, pos: int, start: int) -> int:
     '''
-    Skip mem position to the first char of the current line.
-    Returns position of the current line first char, or -1 if it can't be found
+    Returns position of the first char of the line ending at or containing pos, or -1 if it can't be found after start
     '''
-    end = mem.tell()
+    # negative positions are counted from the end of mem by rfind
+    start = max(start, 0)
     # assuming line should contain TIME_LEN bytes at least
-    begin = end - TIME_LEN
+    begin = pos - TIME_LEN
     if begin < start:
         return -1
-    line_end = mem.rfind(b'\n', start, begin)
+    # most of lines are short, so look for the line end in a small window first, widening it up to start
+    window_end = begin
+    for window in LINE_BEGIN_LEFT_WINDOWS:
+        window_start = max(start, begin - window)
+        line_end = mem.rfind(b'\n', window_start, window_end)
+        if line_end != -1 or window_start == start:
+            break
+        window_end = window_start
     if line_end == -1:
         return -1
-    line_begin = line_end + 1
-    mem.seek(line_begin, SEEK_SET)
-    return line_begin
+    return line_end + 1
+
+def make_time_finder(offsets: tuple[int, ...]):
+    '''
+    Returns a mem_find_time() replacement specialized for the log format: it checks for the time at the given offsets from start first,
+    and falls back to mem_find_time() if none of them has a valid time.
+    '''
+    if not offsets:
+        return mem_find_time
+    def find_time(mem: mmap, start: int, end: int, _pack_valid_time=pack_valid_time, _time_len=TIME_LEN,
+                  _mem_find_time=mem_find_time) -> tuple[int, int]:
+        for offset in offsets:
+            time_begin = start + offset
+            if time_begin <= end:
+                value = _pack_valid_time(mem[time_begin:time_begin + _time_len])
+                if value != -1:
+                    return (time_begin, value)
+        return _mem_find_time(mem, start, end)
+    return find_time
+
+def mem_learn_time_offsets(mem: mmap, end: int) -> tuple[int, ...]:
+    '''
+    Returns offsets of the time in lines found in mem up to end position, the most frequent first
+    '''
+    counts = {}
+    line_begins = mem_line_begins(mem, 0, end)
+    for line_begin, next_line_begin in zip(line_begins, line_begins[1:]):
+        time_begin, _ = mem_find_time(mem, line_begin, next_line_begin)
+        if time_begin != -1:
+            offset = time_begin - line_begin
+            counts[offset] = counts.get(offset, 0) + 1
+    return tuple(sorted(counts, key=counts.get, reverse=True)[:TIME_OFFSETS_MAX])
+
+def mem_advise(mem: mmap, advice: str, start: int = 0, length: int = None):
+    '''
+    Hint the kernel about the access pattern of the mem region, `advice` is the name of `MADV_*` constant.
+    Region is expanded to the page boundaries and clipped to the mem size.
+    Does nothing if the platform or kernel does not support madvise or specified advice.
+    '''
+    advice = getattr(mmap_module, advice, None)
+    if advice is None or not hasattr(mem, 'madvise'):
+        return
+    size = mem.size()
+    end = size if length is None else min(start + length, size)
+    start = max(start, 0) // PAGESIZE * PAGESIZE
+    if end <= start:
+        return
+    try:
+        mem.madvise(advice, start, end - start)
+    except OSError:
+        # it's just a hint, e.g. an advice unknown to the running kernel is rejected with EINVAL
+        pass
 
 def stderr(*rest):
     'Print-like function writing to stderr'
@@ -158,116 +306,250 @@ def debug_binsearch(args: Namespace, *rest):
     if args.debug:
         stderr('#', *rest)
 
-def binary_search(args: Namespace, chunksize: int, mem: mmap, time: bytes, m_begin: int, m_size: int) -> tuple[bool, int]:
+def binary_search(args: Namespace, chunksize: int, mem: mmap, time: int, m_begin: int, m_size: int,
+                  find_time=mem_find_time) -> tuple[bool, int]:
     '''
     Do a binary search in the specified block of the memory mapped file.
     Expecting m_begin to be the offset of the first line char, and m_begin+m_size points to the next line first char after the block end.
-    For m_size <= chunksize perform a simple linear search and return offset of the first or last time.
+    Expecting time to be packed with pack_time().
+    find_time is a mem_find_time() or its replacement from make_time_finder().
+    Time of a line is the first time found from its first char, so a line without time has the time of the next line.
+    The first and the last lines of the block are probed once, then the lines with known times around the searched one
+    are narrowed by probing the middle line between them, until they are closer than chunksize.
+    Then lines of the final chunk are bisected to find the first line with time >= searched one.
     On success returns a tuple (True, <pos>) where <pos> is the position after the matching time.
     On failure returns a tuple (False, -1) or (False, 1), if time should be found in the previous or next time space.
     Raises RuntimeError on unrecoverable failures.
     '''
-
-    if m_size <= chunksize:
-        # finally do a plain search in a relatively small area of chunksize
-        # advancing search begin position to the half of chunk to avoid skipping some lines with the same matching time
-        m_begin -= chunksize // 2
-        end = m_begin + m_size + chunksize // 2
-        mem.seek(m_begin, SEEK_SET)
-        while mem.tell() < end:
-            current_time = mem_extract_time(mem, end)
-            pos = mem.tell()
-            debug_binsearch(args, '--- linear search:', time, pos, current_time)
-            if current_time >= time:
-                return (True, pos)
-            next_line = mem_skip_line_begin_right(mem, end)
-            if next_line == -1:
-                raise RuntimeError('failed to advance to next_line')
-        raise RuntimeError('linear search failed, try to enlarge chunksize')
-
-    # searching in the first line of the left chunk
-    left_chunk_start = m_begin
-    left_chunk_end = left_chunk_start + chunksize
-    left_time = mem_extract_time(mem, left_chunk_end)
-    debug_binsearch(args, '--- binary search:', time, m_begin, m_size, 'left_time:', left_time)
+    dbg = args.debug
+    prefetch = args.prefetch
+    m_end = m_begin + m_size
+
+    # searching in the first line of the block
+    left_line = m_begin
+    left_time_end, left_time = mem_extract_time(mem, left_line, left_line + chunksize, find_time)
+    if dbg:
+        debug_binsearch(args, '--- binary search:', unpack_time(time), m_begin, m_size, 'left_time:', unpack_time(left_time))
     if not left_time:
         raise RuntimeError('failed to extract left_time')
     if time < left_time:
         return (False, -1)
     if time == left_time:
-        return (True, mem.tell() - TIME_LEN)
-    after_left_line = mem_skip_line_begin_right(mem, left_chunk_end)
-    if after_left_line == -1:
-        raise RuntimeError('failed to advace to the after_left_line')
-
-    # searching in the last line of the right chunk
-    right_chunk_end = m_begin + m_size
-    right_chunk_start = right_chunk_end - chunksize
-    mem.seek(right_chunk_end, SEEK_SET)
-    while mem.tell() > right_chunk_start:
-        pos = mem.tell()
-        right_line = mem_skip_line_begin_left(mem, right_chunk_start)
-        if right_line == -1:
-            raise RuntimeError('failed to advance to the right_line')
-        right_time = mem_extract_time(mem, right_chunk_end)
-        if not right_time:
-            mem.seek(pos - 1, SEEK_SET)
-        else:
-            break
-    debug_binsearch(args, '--- binary search:', time, m_begin, m_size, 'right_time:', right_time)
+        return (True, left_time_end)
+
+    # searching in the last line with time of the block, usually it's just the last line,
+    # lines after the found one are shorter than time, so the first time found from it is the last one in the block
+    right_chunk_start = max(m_begin, m_end - chunksize)
+    right_line = mem_line_begin_left(mem, m_end - 1, right_chunk_start)
+    right_time = None
+    if right_line != -1:
+        right_time_end, right_time = mem_extract_time(mem, right_line, m_end, find_time)
+    if not right_time:
+        # the last lines may have no time, e.g. a stack trace, so walk back over all lines of the last chunk
+        line_begins = mem_line_begins(mem, right_chunk_start, m_end)
+        if right_chunk_start != m_begin:
+            # skip the first one, it's in the middle of a line
+            line_begins = line_begins[1:]
+        next_line_begin = m_end
+        for right_line in reversed(line_begins):
+            if right_line < m_end:
+                right_time_end, right_time = mem_extract_time(mem, right_line, next_line_begin, find_time)
+                if right_time:
+                    break
+            next_line_begin = right_line
+    if dbg:
+        debug_binsearch(args, '--- binary search:', unpack_time(time), m_begin, m_size, 'right_time:', unpack_time(right_time))
     if not right_time:
         raise RuntimeError('failed to extract right_time')
     if time > right_time:
         return (False, 1)
-    if time == right_time:
-        return (True, mem.tell() - TIME_LEN)
-    before_right_line = right_line - 1
-
-    # now search in the middle
-    middle_size = before_right_line - after_left_line
-    middle_pos = after_left_line + middle_size // 2
-    middle_chunk_start = middle_pos - chunksize // 2
-    middle_chunk_end = middle_chunk_start + chunksize
-    mem.seek(middle_pos, SEEK_SET)
-    middle_line = mem_skip_line_begin_left(mem, middle_chunk_start)
-    mem.seek(middle_line, SEEK_SET)
-    middle_time = mem_extract_time(mem, middle_chunk_end)
-    debug_binsearch(args, '--- binary search:', time, m_begin, m_size, 'middle_time:', middle_time)
-
-    if time == middle_time:
-        return (True, mem.tell() - TIME_LEN)
-    if time < middle_time:
-        # continue search in the left half, from after_left_line up to middle_line
-        mem.seek(after_left_line, SEEK_SET)
-        return binary_search(args, chunksize, mem, time, after_left_line, middle_line - after_left_line)
-    elif time > middle_time:
-        # continue search in the right half
-        # skip to the next line
-        after_middle_line = mem_skip_line_begin_right(mem, middle_chunk_end)
-        if after_middle_line == -1:
-            raise RuntimeError('failed to advance to after_middle_line')
-        mem.seek(after_middle_line, SEEK_SET)
-        return binary_search(args, chunksize, mem, time, after_middle_line, right_line - after_middle_line)
+
+    # now left_time < time <= right_time, so the first line with time >= searched one is after left_line, up to right_line,
+    # narrow them down by probing only the middle line, times of the lines around it are already known
+    while right_line - left_line > chunksize:
+        middle_pos = (left_line + right_line) // 2
+        middle_chunk_start = middle_pos - chunksize // 2
+        middle_chunk_end = middle_chunk_start + chunksize
+        if prefetch:
+            # the next iteration probes the middle of one of the halves, so start reading both of them
+            # asynchronously, their page faults overlap with the middle probe below
+            for next_middle_pos in ((left_line + middle_pos) // 2, (middle_pos + right_line) // 2):
+                mem_advise(mem, 'MADV_WILLNEED', next_middle_pos - chunksize // 2, chunksize)
+        # the middle line must be after left_line to narrow the lines down
+        middle_line = mem_line_begin_left(mem, middle_pos, max(middle_chunk_start, left_line + 1))
+        if middle_line == -1:
+            raise RuntimeError('failed to advance to the middle_line')
+        middle_time_end, middle_time = mem_extract_time(mem, middle_line, middle_chunk_end, find_time)
+        if dbg:
+            debug_binsearch(args, '--- binary search:', unpack_time(time), left_line, right_line - left_line, 'middle_time:', unpack_time(middle_time))
+        if not middle_time:
+            raise RuntimeError('failed to extract middle_time')
+        if time <= middle_time:
+            right_line, right_time_end = middle_line, middle_time_end
+        else:
+            left_line = middle_line
+
+    # finally do a search in a relatively small area of chunksize
+    # let the kernel prefetch the whole chunk, it will be read sequentially
+    mem_advise(mem, 'MADV_WILLNEED', left_line, right_line - left_line)
+    mem_advise(mem, 'MADV_SEQUENTIAL', left_line, right_line - left_line)
+    # times of the lines are sorted, so bisect the lines after left_line to find the first line with time >= searched one,
+    # if there is no such line, it's the right_line
+    line_begins = mem_line_begins(mem, left_line, right_line)
+    lo, hi = 1, len(line_begins)
+    found_time_end = right_time_end
+    while lo < hi:
+        i = (lo + hi) // 2
+        time_begin, current_time = find_time(mem, line_begins[i], right_line)
+        if dbg:
+            debug_binsearch(args, '--- chunk search:', unpack_time(time), line_begins[i], time_begin, unpack_time(current_time))
+        if time_begin == -1:
+            # no time up to right_line, so the line has the time of right_line
+            hi = i
+            found_time_end = right_time_end
+        elif current_time < time:
+            lo = i + 1
+        else:
+            hi = i
+            found_time_end = time_begin + TIME_LEN
+    return (True, found_time_end)
+
+def sendfile_range(out_fd: int, in_fd: int, offset: int, count: int) -> bool:
+    '''
+    Copy count bytes from in_fd starting at offset to out_fd in kernel with sendfile(), or up to the end of file if count is None.
+    Returns False if nothing was copied because sendfile() doesn't support these fds, True otherwise.
+    '''
+    sent = 0
+    while count is None or sent < count:
+        size = SENDFILE_CHUNKSIZE if count is None else min(SENDFILE_CHUNKSIZE, count - sent)
+        try:
+            n = sendfile(out_fd, in_fd, offset + sent, size)
+        except BrokenPipeError:
+            # the reader is gone, just like `dd` killed by SIGPIPE
+            break
+        except OSError:
+            if sent:
+                raise
+            return False
+        if n == 0:
+            break
+        sent += n
+    return True
+
+def mem_build_index(mem: mmap, start: int, end: int, chunksize: int, find_time=mem_find_time) -> list[tuple[int, int]]:
+    '''
+    Returns a sparse index of lines in mem from start up to end position: a list of tuples (<line_begin>, <time>)
+    for the first line after each INDEX_STEP position, where <time> is the time of that line packed with pack_time().
+    Reads only one chunk of the log file per INDEX_STEP.
+    '''
+    index = []
+    first_pos = -(-start // INDEX_STEP) * INDEX_STEP
+    for pos in range(first_pos, end, INDEX_STEP):
+        line_begin = mem_line_begin_right(mem, pos - 1, end) if pos else 0
+        if line_begin == -1:
+            continue
+        time_begin, time = find_time(mem, line_begin, min(line_begin + chunksize, end))
+        if time_begin != -1:
+            index.append((line_begin, time))
+    return index
+
+def load_index(path: str) -> tuple[int, list[tuple[int, int]]]:
+    '''
+    Returns a tuple (<indexed_size>, <index>) read from the index file, see mem_build_index() for the <index>.
+    Returns None if the file is missing or has another format.
+    '''
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    if len(data) < INDEX_HEADER.size or (len(data) - INDEX_HEADER.size) % INDEX_RECORD.size:
+        return None
+    magic, step, indexed_size = INDEX_HEADER.unpack_from(data)
+    if magic != INDEX_MAGIC or step != INDEX_STEP:
+        return None
+    records = INDEX_RECORD.iter_unpack(memoryview(data)[INDEX_HEADER.size:])
+    return (indexed_size, [(line_begin, pack_time(time)) for line_begin, time in records])
+
+def save_index(path: str, indexed_size: int, index: list[tuple[int, int]]):
+    '''
+    Write the index to the index file, replacing it atomically
+    '''
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_STEP, indexed_size))
+        f.write(b''.join(INDEX_RECORD.pack(line_begin, unpack_time(time)) for line_begin, time in index))
+    replace(tmp_path, path)
+
+def mem_load_index(args: Namespace, mem: mmap, size: int, find_time=mem_find_time) -> tuple[list[int], list[int]]:
+    '''
+    Returns a tuple (<line_begins>, <times>) with the sparse index of the log file lines from its index file.
+    The index file is created if it's missing or doesn't match the log file, and updated if the log file has grown.
+    Returns None if the index file can't be saved, so it's not rebuilt from scratch on each run.
+    '''
+    path = args.filename + INDEX_SUFFIX
+    loaded = load_index(path)
+    indexed_size, index = loaded if loaded else (0, [])
+    if indexed_size > size:
+        debug(args, 'Index is bigger than the log file, rebuilding it')
+        indexed_size, index = 0, []
+    elif index:
+        # the log file could be rotated, so make sure the last indexed line is still the same
+        line_begin, time = index[-1]
+        _, current_time = find_time(mem, line_begin, min(line_begin + args.chunksize, size))
+        if current_time != time:
+            debug(args, 'Index does not match the log file, rebuilding it')
+            indexed_size, index = 0, []
+    if indexed_size < size:
+        # building the index probes the whole file, it pays off only if the next runs can load it
+        if not access(dirname(path) or '.', W_OK):
+            stderr('Warning: index directory is not writable, searching without index:', path)
+            return None
+        index += mem_build_index(mem, indexed_size, size, args.chunksize, find_time)
+        try:
+            save_index(path, size, index)
+            debug(args, 'Index saved:', path, len(index))
+        except OSError as e:
+            stderr('Warning: failed to save index, searching without index:', e)
+            return None
+    debug(args, 'Index:', len(index))
+    return ([line_begin for line_begin, _ in index], [time for _, time in index])
 
 class LogicError(Exception):
     'Exception class for logic errors'
     pass
 
-def do_binary_search(chunksize: int, title: str, args: Namespace, mem: mmap, time: bytes, size: int) -> int:
+def do_binary_search(chunksize: int, title: str, args: Namespace, mem: mmap, time: bytes, size: int,
+                     find_time=mem_find_time, index: tuple[list[int], list[int]] = None, start: int = 0) -> int:
     '''
-    Perform a binary search and return the line position with found time
+    Perform a binary search and return the line position with found time.
+    If index from mem_load_index() is given, search only between the indexed lines around the time.
+    If start is given, it's the first char of a line, and all lines before it are known to have older time.
     '''
-    found, pos = binary_search(args, chunksize, mem, time, 0, size)
+    # compare times as ints in the search
+    packed_time = pack_time(time)
+    m_begin, m_end = start, size
+    if index:
+        line_begins, times = index
+        # the time is after the indexed line i and not after the next one, so search up to the line after the next one
+        i = bisect_left(times, packed_time) - 1
+        if i >= 0:
+            m_begin = max(m_begin, line_begins[i])
+            m_end = line_begins[i + 2] if i + 2 < len(line_begins) else size
+            debug(args, title, 'indexed block:', m_begin, m_end - m_begin)
+    found, pos = binary_search(args, chunksize, mem, packed_time, m_begin, m_end - m_begin, find_time)
     debug(args, title, found, pos)
     if not found:
+        if pos < 0 and m_begin > 0:
+            # lines before the block are older, so the time is at the first line of the block
+            return m_begin
         if pos < 0:
             raise LogicError('log file starts from lines with fresher time than ' + time.decode())
         if pos > 0:
             raise LogicError('log file ends with lines with older time than ' + time.decode())
         raise RuntimeError('unexpected pos: ' + str(pos))
     # advance pos to the line beginning
-    mem.seek(pos, SEEK_SET)
-    line_begin = mem_skip_line_begin_left(mem, pos - chunksize)
+    line_begin = mem_line_begin_left(mem, pos, pos - chunksize)
     if line_begin == -1:
         if pos > chunksize:
             raise RuntimeError('failed to advance to line_begin')
@@ -281,29 +563,21 @@ def fix_time(mem: mmap, args: Namespace, time: str, prev_time: str) -> str:
     if not time:
         return None
     if not is_valid_time(time.encode()):
-        fixed_time = None
-        if SHORT_DATE_TIME_HMS_RE.match(time):
-            fixed_time = time + ':000'
-        if SHORT_DATE_TIME_HM_RE.match(time):
-            fixed_time = time + ':00:000'
-        elif DATE_RE.match(time):
-            fixed_time = time + ' 00:00:00:000'
-        if fixed_time:
+        # only one format can match the time string of the given length
+        time_format = PARTIAL_TIME_FORMATS.get(len(time))
+        if not time_format or not time_format[0].match(time):
+            raise LogicError('failed to fix time `' + time + '` to a valid time string')
+        _, has_date, suffix = time_format
+        if has_date:
+            fixed_time = time + suffix
             debug(args, 'Fixed time', time, '==>', fixed_time)
         else:
             # no date, so use it from the previous time or from first line in the file
             if not prev_time:
-                prev_time = mem_extract_time(mem, args.chunksize)
-                prev_time = prev_time.decode()
+                _, prev_time = mem_extract_time(mem, 0, args.chunksize)
+                prev_time = unpack_time(prev_time).decode()
             date = prev_time[:11] # for 'YYYY/mm/dd '
-            if TIME_RE.match(time):
-                fixed_time = date + time
-            elif TIME_HMS_RE.match(time):
-                fixed_time = date + time + ':000'
-            elif TIME_HM_RE.match(time):
-                fixed_time = date + time + ':00:000'
-            else:
-                raise LogicError('failed to fix time `' + time + '` to a valid time string')
+            fixed_time = date + time + suffix
             debug(args, 'Fixed time', time, 'using date of', prev_time, '==>', fixed_time)
         if not is_valid_time(fixed_time.encode()):
             raise LogicError('failed to fix time `' + time + '` to a valid time string, result is ' + fixed_time)
@@ -323,6 +597,16 @@ def main():
         with open(args.filename, 'r+b') as f:
             mem = mmap(f.fileno(), 0)
             size = mem.size()
+            # binary search probes are widely separated, so disable readahead
+            mem_advise(mem, 'MADV_RANDOM')
+
+            # specialize time search for the log format
+            time_offsets = mem_learn_time_offsets(mem, min(size, TIME_OFFSETS_SCAN_SIZE))
+            debug(args, 'Time offsets in lines:', time_offsets)
+            find_time = make_time_finder(time_offsets)
+
+            # maybe load the index
+            index = mem_load_index(args, mem, size, find_time) if args.index else None
 
             # preprocess args
             time_from = fix_time(mem, args, args.time_from, None)
@@ -335,8 +619,7 @@ def main():
                 raise LogicError('--time-to and --less conflicts')
 
             # search the first time in log
-            mem.seek(0, SEEK_SET)
-            line_begin = do_binary_search(args.chunksize, 'First binary search:', args, mem, time_from.encode(), size)
+            line_begin = do_binary_search(args.chunksize, 'First binary search:', args, mem, time_from.encode(), size, find_time, index)
 
             # make command
             if args.less:
@@ -349,9 +632,8 @@ def main():
                            'status=none',
                            'if=' + quote(args.filename),]
                 if time_to:
-                    # search the to-time in log
-                    mem.seek(0, SEEK_SET)
-                    to_line_begin = do_binary_search(args.chunksize, 'To-time binary search:', args, mem, time_to.encode(), size)
+                    # search the to-time in log, after the first time as time_to >= time_from
+                    to_line_begin = do_binary_search(args.chunksize, 'To-time binary search:', args, mem, time_to.encode(), size, find_time, index, line_begin)
                     command += ['iflag=skip_bytes,count_bytes']
                 else:
                     command += ['iflag=skip_bytes']
@@ -370,6 +652,15 @@ def main():
             # flush stderr with possible debug info
             sys.stderr.flush()
 
+            # copy found lines in kernel without `dd` if possible
+            if args.sendfile and not args.less and not args.arg:
+                count = to_line_begin - line_begin if time_to else None
+                debug(args, 'Sendfile:', line_begin, count)
+                sys.stdout.flush()
+                if sendfile_range(sys.stdout.fileno(), f.fileno(), line_begin, count):
+                    sys.exit()
+                debug(args, 'Sendfile is not supported for stdout, fallback to command')
+
             # and finally execute command with exec(), replacing current process
             execvp(command[0], command)
 